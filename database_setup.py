@@ -5,77 +5,214 @@
 import sqlite3
 from sqlite3 import Error
 import os
+import queue
 import logging
+import functools
+import threading
+from contextlib import contextmanager
 
 # --- Setup ---
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Logging is configured in main() so importing this module as a library stays cheap
 logger = logging.getLogger(__name__)
 
-def create_connection(db_file):
+# This path is inside the Docker container and is mapped to the ./data folder on your host.
+# Override it with GROCERIES_DB_PATH (e.g. for local development outside Docker).
+# Resolved once to an absolute path so a relative value like "groceries.db" still has a parent directory.
+DB_PATH = os.path.abspath(os.environ.get("GROCERIES_DB_PATH", "/app/data/groceries.db"))
+
+# Rows here are tiny, so 4 KiB pages fit the workload. Consider 8192/16384 if blob-heavy tables are added.
+# This only takes effect when the database file is first created.
+PAGE_SIZE = 4096
+
+@functools.lru_cache(maxsize=None)
+def _ensure_dir(path):
+    """ Create a directory once per process; repeat calls are a cache hit with no syscalls """
+    os.makedirs(path, exist_ok=True)
+
+def create_connection(db_file, check_same_thread=True):
     """ Create a database connection to a SQLite database """
     conn = None
     try:
-        # Ensure the directory for the database file exists
-        os.makedirs(os.path.dirname(db_file), exist_ok=True)
-        conn = sqlite3.connect(db_file)
+        # Ensure the directory for the database file exists (a bare file name means the cwd)
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            _ensure_dir(db_dir)
+        conn = sqlite3.connect(db_file, check_same_thread=check_same_thread)
+        if os.path.getsize(db_file) == 0:
+            # A brand-new file: page_size must be set before WAL mode materializes the header
+            conn.execute(f"PRAGMA page_size={PAGE_SIZE}")
+        apply_pragmas(conn)
         return conn
     except Error as e:
         logger.error(f"Error connecting to database: {e}")
+        # Never hand out a connection whose PRAGMAs (WAL, synchronous, ...) were not applied
+        if conn is not None:
+            conn.close()
+    return None
+
+def apply_pragmas(conn):
+    """ Switch the connection to WAL mode and apply performance-related PRAGMAs """
+    # Set first so the WAL switch itself waits out a concurrent lock instead of failing
+    conn.execute("PRAGMA busy_timeout=5000")
+    journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    if journal_mode.lower() != "wal":
+        # WAL is unavailable on some filesystems (e.g. NFS or read-only mounts)
+        logger.warning(f"Could not enable WAL mode, journal_mode is '{journal_mode}'.")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")  # ~64 MB page cache
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB memory-mapped I/O
+    conn.execute("PRAGMA foreign_keys=ON")
+
+def connection_factory(db_file):
+    """ Open a pragma-configured connection that the pool can hand out to any thread """
+    conn = create_connection(db_file, check_same_thread=False)
+    if conn is None:
+        raise Error(f"Cannot open database {db_file}")
+    # Rows can be read by column name as well as unpacked like tuples
+    conn.row_factory = sqlite3.Row
     return conn
 
-def create_table(conn, create_table_sql):
-    """ Create a table from the create_table_sql statement """
+class ConnectionPool:
+    """ A fixed-size, queue-backed pool of warm SQLite connections """
+
+    def __init__(self, db_file, size=5):
+        self.db_file = db_file
+        self._idle = queue.Queue(maxsize=size)
+        try:
+            for _ in range(size):
+                self._idle.put(connection_factory(db_file))
+        except Error:
+            # Don't leak the connections opened before the failure
+            while not self._idle.empty():
+                self._idle.get_nowait().close()
+            raise
+
+    @contextmanager
+    def connection(self):
+        """ Borrow a connection for the duration of a with-block """
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            # Never hand a connection with a dangling transaction to the next caller
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        """ Close every idle connection in the pool and forget it """
+        with _pools_lock:
+            if _pools.get(self.db_file) is self:
+                del _pools[self.db_file]
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_file, size=5):
+    """ Return the process-wide connection pool for db_file, creating it on first use """
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None:
+            pool = _pools[db_file] = ConnectionPool(db_file, size)
+        return pool
+
+def create_schema(conn, *ddl_statements):
+    """ Run all DDL statements as a single atomic transaction """
+    ddl = "BEGIN IMMEDIATE;\n" + ";\n".join(s.strip().rstrip(";") for s in ddl_statements) + ";\nCOMMIT;"
     try:
-        c = conn.cursor()
-        c.execute(create_table_sql)
+        conn.executescript(ddl)
+        return True
     except Error as e:
-        logger.error(f"Error creating table: {e}")
+        logger.error(f"Error creating schema: {e}")
+        if conn.in_transaction:
+            conn.rollback()
+        return False
 
-def main():
-    # This path is inside the Docker container and is mapped to the ./data folder on your host
-    database_path = "/app/data/groceries.db"
-
-    # SQL statement for creating the inventory table
-    # Using 'IF NOT EXISTS' makes this script safe to run multiple times
-    sql_create_inventory_table = """
-    CREATE TABLE IF NOT EXISTS inventory (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        item_name TEXT NOT NULL UNIQUE,
-        quantity REAL NOT NULL DEFAULT 0,
-        unit TEXT,
-        last_updated TIMESTAMP NOT NULL,
-        last_updated_by TEXT NOT NULL
-    );
-    """
-
-    # SQL statement for creating the transaction_log table
-    sql_create_transaction_log_table = """
-    CREATE TABLE IF NOT EXISTS transaction_log (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        item_name TEXT NOT NULL,
-        quantity_change REAL NOT NULL,
-        user_name TEXT NOT NULL,
-        transaction_time TIMESTAMP NOT NULL
-    );
-    """
+# SQL statement for creating the inventory table
+# Using 'IF NOT EXISTS' makes this script safe to run multiple times
+# item_name is the natural lookup key, so it is the clustered primary key (no separate rowid B-tree)
+SQL_CREATE_INVENTORY_TABLE = """
+CREATE TABLE IF NOT EXISTS inventory (
+    item_name TEXT NOT NULL PRIMARY KEY,
+    quantity REAL NOT NULL DEFAULT 0,
+    unit TEXT,
+    last_updated INTEGER NOT NULL,
+    last_updated_by TEXT NOT NULL
+) STRICT, WITHOUT ROWID;
+"""
 
-    # Create a database connection
-    conn = create_connection(database_path)
+# SQL statement for creating the transaction_log table
+# Timestamps in both tables are unix epoch seconds, i.e. int(time.time())
+SQL_CREATE_TRANSACTION_LOG_TABLE = """
+CREATE TABLE IF NOT EXISTS transaction_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_name TEXT NOT NULL,
+    quantity_change REAL NOT NULL,
+    user_name TEXT NOT NULL,
+    transaction_time INTEGER NOT NULL
+) STRICT;
+"""
+
+# SQL statement for creating the ingredient_alias table
+# Holds ingredient-name normalizations learned from Gemini so they are never requested twice
+SQL_CREATE_INGREDIENT_ALIAS_TABLE = """
+CREATE TABLE IF NOT EXISTS ingredient_alias (
+    alias TEXT NOT NULL PRIMARY KEY,
+    normalized_name TEXT NOT NULL
+) STRICT, WITHOUT ROWID;
+"""
+
+# Secondary indexes for per-item history and "recently updated" lookups.
+# inventory.item_name needs no index of its own: it is the clustered primary key, and
+# idx_txlog_item_time also serves plain "WHERE item_name = ?" lookups on transaction_log.
+SQL_CREATE_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_txlog_item_time ON transaction_log(item_name, transaction_time DESC);
+CREATE INDEX IF NOT EXISTS idx_inv_updated ON inventory(last_updated);
+"""
+
+SCHEMA_DDL = (SQL_CREATE_INVENTORY_TABLE, SQL_CREATE_TRANSACTION_LOG_TABLE,
+              SQL_CREATE_INGREDIENT_ALIAS_TABLE, SQL_CREATE_INDEXES)
 
-    # Create tables
-    if conn is not None:
-        create_table(conn, sql_create_inventory_table)
-        logger.info("Table 'inventory' checked/created successfully.")
+def init_schema(conn):
+    """ Create any missing tables and indexes, then refresh planner statistics """
+    # Create tables in one transaction so a crash can't leave a partial schema
+    if not create_schema(conn, *SCHEMA_DDL):
+        return False
+    logger.info("Tables 'inventory', 'transaction_log' and 'ingredient_alias' checked/created successfully.")
+    # Bound every ANALYZE (here and in PRAGMA optimize) so the growing transaction_log isn't fully scanned
+    conn.execute("PRAGMA analysis_limit=400")
+    # Gather statistics once, so the query planner picks up the indexes right away.
+    # Later runs leave refreshing them to PRAGMA optimize.
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone() and conn.execute("SELECT 1 FROM sqlite_stat1 LIMIT 1").fetchone()
+    if not has_stats:
+        conn.execute("ANALYZE")
+    return True
 
-        create_table(conn, sql_create_transaction_log_table)
-        logger.info("Table 'transaction_log' checked/created successfully.")
+def main():
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            level=logging.INFO
+        )
 
-        conn.close()
-    else:
+    # Create a database connection
+    try:
+        pool = get_pool(DB_PATH, size=1)
+    except Error:
         logger.error("Error! Cannot create the database connection.")
+        return
+
+    with pool.connection() as conn:
+        init_schema(conn)
+
+        # Refresh planner statistics that have gone stale; init_schema set analysis_limit to keep this bounded
+        conn.execute("PRAGMA optimize")
+    pool.close()
 
 if __name__ == '__main__':
     main()
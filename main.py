@@ -1,18 +1,27 @@
 import os
+import copy
+import time
+import asyncio
+import hashlib
 import logging
 import random
+import re
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, MessageHandler, filters, CallbackQueryHandler
 from dotenv import load_dotenv
 import google.generativeai as genai
-import json
+import orjson
 from PIL import Image # Impor baru untuk gambar
 
 # --- Local Imports ---
 from utils.SpeechtoText import SpeechToText
+from utils.cache import LRUCache
 from utils.database import update_inventory, query_inventory, query_all_inventory, clear_all_inventory
+from utils.database import load_ingredient_aliases, save_ingredient_alias
 
 # --- Setup ---
 logging.basicConfig(
@@ -47,22 +56,110 @@ except Exception as e:
     logger.error(f"Failed to initialize Gemini: {e}")
     exit()
 
+# Gemini is asked for raw JSON; _FENCE only strips a ```json ... ``` wrapper if one still comes back
+JSON_GENERATION_CONFIG = {"response_mime_type": "application/json"}
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.M)
+
+# Greetings and the fixed commands the bot advertises are classified locally, without Gemini
+_GREETING_RE = re.compile(r"^(?:(?:hai|halo|hi|hello|hey|test|tes|ok|oke|thanks|makasih|terimakasih)\W*|\W+)$", re.I)
+_KEYWORD_INTENTS = (
+    (re.compile(r"^(stok|list|semua|semua stok|cek stok|lihat stok)$"), "QUERY_ALL"),
+    (re.compile(r"^(resep|lihat resep)$"), "RECIPE"),
+    (re.compile(r"^(hapus semua|kosongkan stok|clear all|reset inventory|bersihkan semua)$"), "CLEAR_ALL"),
+)
+
+# Exact-match cache for Gemini intents, keyed on whitespace-normalized lowercase text
+intent_cache = LRUCache(maxsize=4096)
+
+def _cache_key(text: str) -> str:
+    return " ".join(text.lower().split())
+
+# Recipe suggestions per pantry snapshot; entries are (expires_at, recipe_data) and expire after the TTL
+RECIPE_CACHE_TTL = 3600  # seconds
+recipe_cache = LRUCache(maxsize=256)
+
+def _recipe_cache_key(available_items: list) -> bytes:
+    snapshot = sorted((name, round(quantity, 1)) for name, quantity, unit in available_items)
+    return hashlib.blake2b(repr(snapshot).encode(), digest_size=16).digest()
+
+# Common ingredient variations mapped to their standard name.
+# Normalizations learned from Gemini are added at runtime and persisted in the database.
+INGREDIENT_ALIASES: dict[str, str] = {
+    "ayam": "ayam",
+    "daging ayam": "ayam",
+    "ayam broiler": "ayam",
+    "chicken": "ayam",
+    "sapi": "sapi",
+    "daging sapi": "sapi",
+    "beef": "sapi",
+    "beras": "beras",
+    "beras putih": "beras",
+    "rice": "beras",
+    "telur": "telur",
+    "telur ayam": "telur",
+    "egg": "telur",
+    "eggs": "telur",
+    "gula": "gula",
+    "gula pasir": "gula",
+    "sugar": "gula",
+    "minyak goreng": "minyak goreng",
+    "cooking oil": "minyak goreng",
+    "kentang": "kentang",
+    "wortel": "wortel",
+    "garam": "garam",
+    "bawang merah": "bawang merah",
+    "bawang putih": "bawang putih",
+    "cabai": "cabai",
+    "cabe": "cabai",
+    "tahu": "tahu",
+    "tempe": "tempe",
+    "susu": "susu",
+    "mie instan": "mie instan",
+}
+INGREDIENT_PREFIXES = ("daging ", "buah ", "biji ")
+
 # Inisialisasi ptb_app tanpa handler terlebih dahulu
 ptb_app = Application.builder().token(TELEGRAM_TOKEN).build()
 
+# Only the update types the bot has handlers for; Telegram doesn't send (or count) the rest.
+# Locations and contacts arrive as "message" updates, so they still reach handle_unsupported_message.
+WEBHOOK_ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+WEBHOOK_MAX_CONNECTIONS = 40  # Parallel webhook POSTs Telegram may open
+
+GEMINI_WARMUP_TIMEOUT = 5  # Seconds startup waits for the Gemini warm-up call
+
 # --- FastAPI Lifespan Events ---
 # PERBAIKAN: Gunakan lifespan untuk mengelola inisialisasi dan shutdown
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Sebelum server dimulai (startup)
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IO_THREAD_POOL_SIZE, thread_name_prefix="bot-io")
+    )
+    INGREDIENT_ALIASES.update(await asyncio.to_thread(load_ingredient_aliases))
+    logger.info(f"Loaded {len(INGREDIENT_ALIASES)} ingredient aliases.")
+
+    # Warm up Gemini's async client so the first user message doesn't pay for channel setup.
+    # Every Gemini call goes through generate_content_async, so there is no sync client to warm.
+    # Bounded so a slow or unreachable Gemini never holds up webhook registration.
+    try:
+        await asyncio.wait_for(llm.generate_content_async("ping"), timeout=GEMINI_WARMUP_TIMEOUT)
+        logger.info("Gemini connection warmed up.")
+    except Exception as e:
+        logger.warning(f"Gemini warm-up failed, continuing anyway: {e}")
+
     logger.info("Initializing PTB Application...")
     await ptb_app.initialize()
     if WEBHOOK_URL:
         logger.info(f"Setting webhook to {WEBHOOK_URL}/webhook")
-        await ptb_app.bot.set_webhook(f"{WEBHOOK_URL}/webhook")
+        await ptb_app.bot.set_webhook(
+            f"{WEBHOOK_URL}/webhook",
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=WEBHOOK_ALLOWED_UPDATES,
+        )
     
     # Daftarkan semua handler di sini setelah inisialisasi
-    text_handler = MessageHandler(filters.TEXT & ~filters.COMMAND, lambda u, c: handle_text_message(u, u.message.text))
+    text_handler = MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message)
     voice_handler = MessageHandler(filters.VOICE, handle_voice_message)
     image_handler = MessageHandler(filters.PHOTO, handle_image_message)
     sticker_handler = MessageHandler(filters.Sticker.ALL, handle_sticker_message)
@@ -81,215 +178,276 @@ async def lifespan(app: FastAPI):
     logger.info("PTB Application initialized and handlers registered.")
     yield
     # Setelah server dimatikan (shutdown)
+    await drain_pending_updates()
     logger.info("Shutting down PTB Application...")
     await ptb_app.shutdown()
 
 # Inisialisasi FastAPI dengan lifespan manager
 app = FastAPI(lifespan=lifespan)
 
+# --- Prompts ---
+# Static prompt text is built once; only the user-specific part is concatenated per call
+_INTENT_PROMPT_PREFIX = """
+You are a grocery management assistant. Analyze the user's text and determine the action.
+The possible actions are 'ADD', 'USE', 'QUERY', 'QUERY_ALL', 'RECIPE', 'CLEAR_ALL', or 'UNRELATED'.
+- 'ADD': for buying or getting new groceries.
+- 'USE': for consuming or using up groceries.
+- 'QUERY': for asking about a specific item's stock.
+- 'QUERY_ALL': for asking to see all available stock.
+- 'RECIPE': for asking recipe suggestions based on available ingredients (e.g., "apa yang bisa dimasak?", "resep apa yang bisa dibuat?", "mau masak apa?").
+- 'CLEAR_ALL': for clearing all inventory items (e.g., "hapus semua", "kosongkan stok", "clear all", "reset inventory", "bersihkan semua").
+- 'UNRELATED': for greetings, tests, or any conversation not related to groceries.
+
+For every item, also provide "normalized_name": the ingredient's standard Indonesian name.
+- Convert to lowercase
+- Use the most common Indonesian name
+- Remove unnecessary words like "daging", "buah", "biji" when they don't change the core ingredient
+- Standardize similar items to one name
+- Examples: "daging ayam" → "ayam", "ayam broiler" → "ayam", "daging sapi" → "sapi", "beras putih" → "beras",
+  "telur ayam" → "telur", "gula pasir" → "gula", "minyak goreng" → "minyak goreng" (keep as is, it's specific)
+
+Respond with only a JSON object in the following format:
+{
+  "action": "ADD|USE|QUERY|QUERY_ALL|RECIPE|CLEAR_ALL|UNRELATED",
+  "items": [
+    {"name": "item name", "normalized_name": "normalized item name", "quantity": number, "unit": "unit type"}
+  ]
+}
+For QUERY_ALL, RECIPE, CLEAR_ALL, and UNRELATED, the items list can be empty.
+
+User text: \""""
+_INTENT_PROMPT_SUFFIX = '"\n'
+
+_RECEIPT_PROMPT = """
+You are an expert receipt scanner for an Indonesian grocery bot. 
+Analyze this receipt image and extract all grocery items and their quantities.
+- Ignore headers, footers, totals, taxes, discounts, and any non-grocery items.
+- Standardize item names to common Indonesian grocery terms (e.g., "AYAM BROILER" → "ayam", "DAGING SAPI" → "sapi").
+- Remove brand names and focus on the core ingredient (e.g., "INDOMIE GORENG" → "mie instan").
+- Determine the quantity and unit for each item.
+- If you can't determine the quantity, assume 1 piece.
+- Use standard units: kg, gram, liter, ml, pcs, butir, bungkus.
+- Common Indonesian grocery items: beras (rice), minyak goreng (cooking oil), gula (sugar), telur (eggs), ayam (chicken), sapi (beef), etc.
+
+Respond with only a JSON object in the following format:
+{
+  "action": "ADD",
+  "items": [
+    {"name": "item name", "quantity": number, "unit": "unit type"}
+  ]
+}
+
+If you cannot find any grocery items, return:
+{
+  "action": "ADD",
+  "items": []
+}"""
+
+_RECIPE_PROMPT_PREFIX = """
+You are an Indonesian recipe expert. Based on the available ingredients below, suggest 3-5 delicious Indonesian recipes that can be made.
+
+Available ingredients: """
+_RECIPE_PROMPT_SUFFIX = """
+
+Requirements:
+- Focus on popular Indonesian dishes
+- Use as many available ingredients as possible
+- Include recipes that are practical and easy to make
+- If some ingredients are missing, mention them as "additional ingredients needed"
+- Provide brief cooking instructions
+
+Respond with only a JSON object in the following format:
+{
+  "recipes": [
+    {
+      "name": "Recipe Name",
+      "description": "Brief description of the dish",
+      "ingredients_used": ["ingredient1", "ingredient2"],
+      "additional_ingredients": ["ingredient3", "ingredient4"],
+      "cooking_time": "30 minutes",
+      "difficulty": "Easy/Medium/Hard",
+      "instructions": "Brief cooking steps"
+    }
+  ]
+}"""
+
+_NORMALIZE_PROMPT_PREFIX = """
+You are an Indonesian grocery expert. Normalize the following ingredient name to its standard form.
+
+Rules:
+- Convert to lowercase
+- Use the most common Indonesian name
+- Remove unnecessary words like "daging", "buah", "biji" when they don't change the core ingredient
+- Standardize similar items to one name
+
+Examples:
+- "daging ayam" → "ayam"
+- "ayam broiler" → "ayam" 
+- "daging sapi" → "sapi"
+- "beras putih" → "beras"
+- "telur ayam" → "telur"
+- "minyak goreng" → "minyak goreng" (keep as is, it's specific)
+- "gula pasir" → "gula"
+- "kentang" → "kentang"
+- "wortel" → "wortel"
+
+Input ingredient: \""""
+_NORMALIZE_PROMPT_SUFFIX = '"\n\nRespond with only the normalized name in lowercase, no quotes, no explanations.'
+
 # --- Gemini Functions ---
-def get_intent_from_text(text: str) -> dict:
-    prompt = f"""
-    You are a grocery management assistant. Analyze the user's text and determine the action.
-    The possible actions are 'ADD', 'USE', 'QUERY', 'QUERY_ALL', 'RECIPE', 'CLEAR_ALL', or 'UNRELATED'.
-    - 'ADD': for buying or getting new groceries.
-    - 'USE': for consuming or using up groceries.
-    - 'QUERY': for asking about a specific item's stock.
-    - 'QUERY_ALL': for asking to see all available stock.
-    - 'RECIPE': for asking recipe suggestions based on available ingredients (e.g., "apa yang bisa dimasak?", "resep apa yang bisa dibuat?", "mau masak apa?").
-    - 'CLEAR_ALL': for clearing all inventory items (e.g., "hapus semua", "kosongkan stok", "clear all", "reset inventory", "bersihkan semua").
-    - 'UNRELATED': for greetings, tests, or any conversation not related to groceries.
-
-    Respond with only a JSON object in the following format:
-    {{
-      "action": "ADD|USE|QUERY|QUERY_ALL|RECIPE|CLEAR_ALL|UNRELATED",
-      "items": [
-        {{"name": "item name", "quantity": number, "unit": "unit type"}}
-      ]
-    }}
-    For QUERY_ALL, RECIPE, CLEAR_ALL, and UNRELATED, the items list can be empty.
-
-    User text: "{text}"
+async def _call_gemini_json(parts, label: str):
+    """
+    Sends parts to Gemini in JSON mode and returns the parsed reply.
+    Returns None (after logging why) if the call fails or the reply isn't a valid JSON object.
     """
     try:
-        response = llm.generate_content(prompt)
-        cleaned_response = response.text.strip().replace('`', '').replace('json', '')
-        logger.info(f"Gemini raw response: {cleaned_response}")
-        return json.loads(cleaned_response)
+        response = await llm.generate_content_async(parts, generation_config=JSON_GENERATION_CONFIG)
+        if not response or not response.text:
+            logger.error(f"No response from Gemini for {label}")
+            return None
+
+        cleaned_response = _FENCE.sub("", response.text).strip()
+        logger.info(f"Gemini {label} raw response: {cleaned_response}")
+        parsed = orjson.loads(cleaned_response)
+        # Callers read fields with .get(), so a top-level list or scalar is as unusable as bad JSON
+        if not isinstance(parsed, dict):
+            logger.error(f"Gemini {label} reply is a {type(parsed).__name__}, not a JSON object")
+            return None
+        return parsed
+    except orjson.JSONDecodeError as e:
+        logger.error(f"JSON parsing error in {label}: {e}")
+        return None
     except Exception as e:
-        logger.error(f"Error parsing intent with Gemini: {e}")
+        logger.error(f"Error getting {label} from Gemini: {e}", exc_info=True)
         return None
 
-def get_items_from_receipt(image_path: str) -> dict:
+def get_fast_intent(text: str) -> dict:
+    """Returns the intent for greetings and fixed commands, or None if Gemini is needed."""
+    if _GREETING_RE.match(text.strip()):
+        return {"action": "UNRELATED", "items": []}
+    command = _cache_key(text).rstrip("!?.")
+    for pattern, action in _KEYWORD_INTENTS:
+        if pattern.match(command):
+            return {"action": action, "items": []}
+    return None
+
+async def get_intent_from_text(text: str) -> dict:
+    cache_key = _cache_key(text)
+    cached = intent_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Intent cache hit for: {text}")
+        # Callers mutate the items, so never hand out the cached object itself
+        return copy.deepcopy(cached)
+
+    prompt = _INTENT_PROMPT_PREFIX + text + _INTENT_PROMPT_SUFFIX
+    intent_data = await _call_gemini_json(prompt, "intent")
+    if intent_data is not None:
+        intent_cache.put(cache_key, copy.deepcopy(intent_data))
+    return intent_data
+
+# Receipts are downscaled before upload; this is still plenty for OCR and cuts bytes and image tokens
+RECEIPT_MAX_DIMENSION = 1600
+RECEIPT_JPEG_QUALITY = 85
+
+def _prepare_receipt_image(image_data: bytes) -> bytes:
+    """Downscales a receipt photo and re-encodes it as JPEG (blocking, run it in a worker thread)."""
+    img = Image.open(BytesIO(image_data))
+    logger.info(f"Image opened successfully. Size: {img.size}, Mode: {img.mode}")
+    img.thumbnail((RECEIPT_MAX_DIMENSION, RECEIPT_MAX_DIMENSION), Image.LANCZOS)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=RECEIPT_JPEG_QUALITY)
+    return buffer.getvalue()
+
+async def get_items_from_receipt(image_data: bytes) -> dict:
     """Uses Gemini Vision to extract items from a receipt image."""
-    logger.info(f"Starting receipt analysis for image: {image_path}")
+    logger.info(f"Starting receipt analysis for image of {len(image_data)} bytes")
     try:
-        # Check if file exists
-        if not os.path.exists(image_path):
-            logger.error(f"Image file not found: {image_path}")
-            return None
-            
-        img = Image.open(image_path)
-        logger.info(f"Image opened successfully. Size: {img.size}, Mode: {img.mode}")
-        
-        prompt = """
-        You are an expert receipt scanner for an Indonesian grocery bot. 
-        Analyze this receipt image and extract all grocery items and their quantities.
-        - Ignore headers, footers, totals, taxes, discounts, and any non-grocery items.
-        - Standardize item names to common Indonesian grocery terms (e.g., "AYAM BROILER" → "ayam", "DAGING SAPI" → "sapi").
-        - Remove brand names and focus on the core ingredient (e.g., "INDOMIE GORENG" → "mie instan").
-        - Determine the quantity and unit for each item.
-        - If you can't determine the quantity, assume 1 piece.
-        - Use standard units: kg, gram, liter, ml, pcs, butir, bungkus.
-        - Common Indonesian grocery items: beras (rice), minyak goreng (cooking oil), gula (sugar), telur (eggs), ayam (chicken), sapi (beef), etc.
-
-        Respond with only a JSON object in the following format:
-        {
-          "action": "ADD",
-          "items": [
-            {"name": "item name", "quantity": number, "unit": "unit type"}
-          ]
-        }
-        
-        If you cannot find any grocery items, return:
-        {
-          "action": "ADD",
-          "items": []
-        }
-        """
-        
-        logger.info("Sending image to Gemini Vision API...")
-        response = llm.generate_content([prompt, img])
-        
-        if not response or not response.text:
-            logger.error("No response from Gemini Vision API")
-            return None
-            
-        cleaned_response = response.text.strip().replace('`', '').replace('json', '').strip()
-        logger.info(f"Gemini Vision raw response: {cleaned_response}")
-        
-        # Try to parse JSON
-        parsed_data = json.loads(cleaned_response)
-        logger.info(f"Successfully parsed receipt data: {parsed_data}")
-        return parsed_data
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error in receipt analysis: {e}")
-        logger.error(f"Raw response was: {cleaned_response if 'cleaned_response' in locals() else 'No response'}")
-        return None
+        jpeg_data = await asyncio.to_thread(_prepare_receipt_image, image_data)
     except Exception as e:
-        logger.error(f"Error parsing receipt with Gemini Vision: {e}", exc_info=True)
+        logger.error(f"Error opening receipt image: {e}", exc_info=True)
         return None
+    
+    logger.info(f"Sending {len(jpeg_data)} byte image to Gemini Vision API...")
+    image_part = {"mime_type": "image/jpeg", "data": jpeg_data}
+    parsed_data = await _call_gemini_json([_RECEIPT_PROMPT, image_part], "receipt analysis")
+    if parsed_data is not None:
+        logger.info(f"Successfully parsed receipt data: {parsed_data}")
+    return parsed_data
 
-def get_recipe_suggestions(available_items: list) -> dict:
+async def get_recipe_suggestions(available_items: list) -> dict:
     """Uses Gemini to suggest recipes based on available ingredients."""
     logger.info(f"Getting recipe suggestions for {len(available_items)} items")
-    try:
-        # Create a list of available ingredients
-        ingredients_text = ", ".join([f"{item[1]} {item[2]} {item[0]}" for item in available_items])
-        
-        prompt = f"""
-        You are an Indonesian recipe expert. Based on the available ingredients below, suggest 3-5 delicious Indonesian recipes that can be made.
-        
-        Available ingredients: {ingredients_text}
-        
-        Requirements:
-        - Focus on popular Indonesian dishes
-        - Use as many available ingredients as possible
-        - Include recipes that are practical and easy to make
-        - If some ingredients are missing, mention them as "additional ingredients needed"
-        - Provide brief cooking instructions
-        
-        Respond with only a JSON object in the following format:
-        {{
-          "recipes": [
-            {{
-              "name": "Recipe Name",
-              "description": "Brief description of the dish",
-              "ingredients_used": ["ingredient1", "ingredient2"],
-              "additional_ingredients": ["ingredient3", "ingredient4"],
-              "cooking_time": "30 minutes",
-              "difficulty": "Easy/Medium/Hard",
-              "instructions": "Brief cooking steps"
-            }}
-          ]
-        }}
-        """
-        
-        logger.info("Sending ingredients to Gemini for recipe suggestions...")
-        response = llm.generate_content(prompt)
-        
-        if not response or not response.text:
-            logger.error("No response from Gemini for recipe suggestions")
-            return None
-            
-        cleaned_response = response.text.strip().replace('`', '').replace('json', '').strip()
-        logger.info(f"Gemini recipe response: {cleaned_response}")
-        
-        # Try to parse JSON
-        parsed_data = json.loads(cleaned_response)
+    cache_key = _recipe_cache_key(available_items)
+    cached = recipe_cache.get(cache_key)
+    if cached is not None and cached[0] > time.monotonic():
+        logger.info("Using cached recipe suggestions for unchanged inventory")
+        return copy.deepcopy(cached[1])
+
+    # Create a list of available ingredients
+    ingredients_text = ", ".join(f"{quantity} {unit} {name}" for name, quantity, unit in available_items)
+    
+    prompt = _RECIPE_PROMPT_PREFIX + ingredients_text + _RECIPE_PROMPT_SUFFIX
+    
+    logger.info("Sending ingredients to Gemini for recipe suggestions...")
+    parsed_data = await _call_gemini_json(prompt, "recipe suggestions")
+    if parsed_data is not None:
         logger.info(f"Successfully parsed recipe suggestions: {len(parsed_data.get('recipes', []))} recipes")
-        return parsed_data
-        
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error in recipe suggestions: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Error getting recipe suggestions: {e}", exc_info=True)
-        return None
+        recipe_cache.put(cache_key, (time.monotonic() + RECIPE_CACHE_TTL, copy.deepcopy(parsed_data)))
+    return parsed_data
+
+# Longest Gemini answer accepted as a normalized ingredient name
+MAX_NORMALIZED_NAME_LENGTH = 50
+
+async def normalize_ingredient_name(item_name: str) -> str:
+    """
+    Normalize ingredient names to handle variations and synonyms.
+    Fallback only: get_intent_from_text normalizes item names in the same request.
+    Known aliases and simple prefixes are resolved locally; Gemini is only asked about
+    new names, and its answer is remembered in INGREDIENT_ALIASES.
+    """
+    name = _cache_key(item_name)
+    if name in INGREDIENT_ALIASES:
+        return INGREDIENT_ALIASES[name]
+
+    # Remove common prefixes ("daging kambing" → "kambing")
+    for prefix in INGREDIENT_PREFIXES:
+        if name.startswith(prefix):
+            stripped = name[len(prefix):]
+            return INGREDIENT_ALIASES.get(stripped, stripped)
 
-def normalize_ingredient_name(item_name: str) -> str:
-    """Normalize ingredient names to handle variations and synonyms."""
-    logger.info(f"Normalizing ingredient name: {item_name}")
+    logger.info(f"Normalizing ingredient name with Gemini: {item_name}")
     try:
-        prompt = f"""
-        You are an Indonesian grocery expert. Normalize the following ingredient name to its standard form.
-        
-        Rules:
-        - Convert to lowercase
-        - Use the most common Indonesian name
-        - Remove unnecessary words like "daging", "buah", "biji" when they don't change the core ingredient
-        - Standardize similar items to one name
-        
-        Examples:
-        - "daging ayam" → "ayam"
-        - "ayam broiler" → "ayam" 
-        - "daging sapi" → "sapi"
-        - "beras putih" → "beras"
-        - "telur ayam" → "telur"
-        - "minyak goreng" → "minyak goreng" (keep as is, it's specific)
-        - "gula pasir" → "gula"
-        - "kentang" → "kentang"
-        - "wortel" → "wortel"
-        
-        Input ingredient: "{item_name}"
-        
-        Respond with only the normalized name in lowercase, no quotes, no explanations.
-        """
-        
-        response = llm.generate_content(prompt)
-        normalized = response.text.strip().lower()
+        prompt = _NORMALIZE_PROMPT_PREFIX + item_name + _NORMALIZE_PROMPT_SUFFIX
+        
+        response = await llm.generate_content_async(prompt)
+        normalized = response.text.strip().strip("\"'`").strip().lower()
+        # The answer is remembered for good, so only accept a plain, short ingredient name
+        if not normalized or "\n" in normalized or len(normalized) > MAX_NORMALIZED_NAME_LENGTH:
+            logger.warning(f"Ignoring unusable normalization for '{item_name}': {response.text!r}")
+            return name
         logger.info(f"Normalized '{item_name}' to '{normalized}'")
+        INGREDIENT_ALIASES[name] = normalized
+        await asyncio.to_thread(save_ingredient_alias, name, normalized)
         return normalized
         
     except Exception as e:
         logger.error(f"Error normalizing ingredient '{item_name}': {e}")
-        # Fallback: basic normalization
-        normalized = item_name.lower().strip()
-        # Remove common prefixes
-        for prefix in ["daging ", "buah ", "biji "]:
-            if normalized.startswith(prefix):
-                normalized = normalized[len(prefix):]
-        return normalized
+        # Fallback: basic normalization (prefixes were already handled above)
+        return name
 
 # --- Bot Logic Handlers ---
-async def handle_text_message(update: Update, user_text: str):
+async def handle_text_message(update: Update, context, user_text: str = None):
+    # Text updates are dispatched here directly; voice notes pass their transcription as user_text
+    if user_text is None:
+        user_text = update.message.text
     user_name = update.message.from_user.first_name
     chat_id = update.message.chat_id
     
     logger.info(f"Processing text from {user_name}: {user_text}")
     
-    intent_data = get_intent_from_text(user_text)
+    intent_data = get_fast_intent(user_text) or await get_intent_from_text(user_text)
     
     if intent_data:
         action_value = intent_data.get("action")
@@ -300,20 +458,39 @@ async def handle_text_message(update: Update, user_text: str):
             if not items:
                 reply_text = "Maaf, saya tidak bisa menemukan item apa pun dalam permintaan Anda."
             else:
+                # Names already in stock are canonical and need neither normalization nor a lookup
+                known = {row["item_name"] for row in await asyncio.to_thread(query_all_inventory)}
+
+                # Lowercase each name once; stored names are lowercase, and update_inventory expects them so
+                original_names = [item.get("name") for item in items]
+                for item, original_name in zip(items, original_names):
+                    item["name"] = original_name.lower()
+
+                # The intent call already normalized the names; normalize any it left out concurrently
+                missing = [item for item in items
+                           if not item.get("normalized_name") and item["name"] not in known]
+                if missing:
+                    normalized = await asyncio.gather(*(normalize_ingredient_name(item["name"]) for item in missing))
+                    for item, normalized_name in zip(missing, normalized):
+                        item["normalized_name"] = normalized_name
+
                 # Smart ingredient matching and feedback
                 merged_items = []
-                for item in items:
-                    original_name = item.get("name")
-                    from utils.database import find_similar_item
-                    matched_name = find_similar_item(original_name, normalize_ingredient_name)
+                for item, original_name in zip(items, original_names):
+                    if item["name"] in known:
+                        matched_name = item["name"]
+                    else:
+                        # Stored names are lowercase, so the normalized name is the row it belongs to
+                        matched_name = item["normalized_name"].lower()
                     
-                    if original_name.lower() != matched_name:
+                    if item["name"] != matched_name:
                         merged_items.append(f"'{original_name}' → '{matched_name}'")
                     
                     item["name"] = matched_name
                     logger.info(f"Item '{original_name}' processed as '{matched_name}'")
                 
-                success = update_inventory(action, items, user_name)
+                # SQLite calls are blocking, so run them in a worker thread to keep other updates moving
+                success = await asyncio.to_thread(update_inventory, action, items, user_name)
                 if success:
                     reply_lines = [f"Sip, {user_name}! Stok telah berhasil diperbarui."]
                     
@@ -326,7 +503,7 @@ async def handle_text_message(update: Update, user_text: str):
                         if len(merged_items) > 3:
                             reply_lines.append(f"   ... dan {len(merged_items) - 3} lainnya")
                     
-                    all_items = query_all_inventory()
+                    all_items = await asyncio.to_thread(query_all_inventory)
                     if not all_items:
                         reply_lines.append("\nStok sekarang kosong.")
                     else:
@@ -352,11 +529,11 @@ async def handle_text_message(update: Update, user_text: str):
             if not items:
                  reply_text = "Maaf, item apa yang ingin Anda cek?"
             else:
-                item_name_to_check = items[0].get("name")
-                reply_text = query_inventory(item_name_to_check)
+                item_name_to_check = items[0].get("normalized_name") or items[0].get("name")
+                reply_text = await asyncio.to_thread(query_inventory, item_name_to_check)
 
         elif action == "QUERY_ALL":
-            all_items = query_all_inventory()
+            all_items = await asyncio.to_thread(query_all_inventory)
             if not all_items:
                 reply_text = "Saat ini stok masih kosong."
             else:
@@ -366,14 +543,14 @@ async def handle_text_message(update: Update, user_text: str):
                 reply_text = "\n".join(reply_lines)
         
         elif action == "RECIPE":
-            all_items = query_all_inventory()
+            all_items = await asyncio.to_thread(query_all_inventory)
             if not all_items:
                 reply_text = "Maaf, stok Anda masih kosong. Tambahkan bahan-bahan terlebih dahulu untuk mendapatkan saran resep! 🍳"
             else:
                 # Send "thinking" message
                 thinking_msg = await ptb_app.bot.send_message(chat_id=chat_id, text="🍳 Sedang mencari resep yang cocok dengan bahan Anda...")
                 
-                recipe_data = get_recipe_suggestions(all_items)
+                recipe_data = await get_recipe_suggestions(all_items)
                 
                 # Delete thinking message
                 await ptb_app.bot.delete_message(chat_id=chat_id, message_id=thinking_msg.message_id)
@@ -412,7 +589,7 @@ async def handle_text_message(update: Update, user_text: str):
                     reply_text = "Maaf, saya tidak bisa menemukan resep yang cocok dengan bahan yang tersedia saat ini. Coba tambah lebih banyak bahan! 😅"
         
         elif action == "CLEAR_ALL":
-            all_items = query_all_inventory()
+            all_items = await asyncio.to_thread(query_all_inventory)
             if not all_items:
                 reply_text = "Stok Anda sudah kosong, tidak ada yang perlu dihapus."
             else:
@@ -454,15 +631,15 @@ async def handle_voice_message(update: Update, context):
         user_name = update.message.from_user.first_name
         voice = update.message.voice
         voice_file = await voice.get_file()
-        temp_audio_path = f"{voice.file_id}.ogg"
-        await voice_file.download_to_drive(temp_audio_path)
-        logger.info(f"Downloaded voice note from {user_name} to {temp_audio_path}")
-        results = transcriber.transcribe_audio(temp_audio_path)
-        os.remove(temp_audio_path)
+        # Keep the voice note in memory instead of writing it to disk first
+        audio_data = bytes(await voice_file.download_as_bytearray())
+        logger.info(f"Downloaded voice note from {user_name} ({len(audio_data)} bytes)")
+        # The Speech call is awaited on the async client; only the audio conversion runs in a worker thread
+        results = await transcriber.transcribe_audio(audio_data)
         if results:
             transcribed_text = results[0].alternatives[0].transcript
             logger.info(f"Transcription result: '{transcribed_text}'")
-            await handle_text_message(update, transcribed_text)
+            await handle_text_message(update, context, transcribed_text)
         else:
             await ptb_app.bot.send_message(chat_id=chat_id, text="Maaf, saya tidak bisa memahami audio tersebut.")
     except Exception as e:
@@ -486,21 +663,15 @@ async def handle_image_message(update: Update, context):
         logger.info(f"Processing photo with file_id: {photo.file_id}")
         
         photo_file = await photo.get_file()
-        temp_image_path = f"{photo.file_id}.jpg"
-        
-        await photo_file.download_to_drive(temp_image_path)
-        logger.info(f"Downloaded receipt from {user_name} to {temp_image_path}")
+        # Keep the photo in memory; it only needs to reach Gemini, not the disk
+        image_data = bytes(await photo_file.download_as_bytearray())
+        logger.info(f"Downloaded receipt from {user_name} ({len(image_data)} bytes)")
 
         # Send processing message to user
         processing_msg = await update.message.reply_text("📸 Sedang memproses foto struk Anda...")
         
-        receipt_data = get_items_from_receipt(temp_image_path)
+        receipt_data = await get_items_from_receipt(image_data)
         logger.info(f"Receipt data extracted: {receipt_data}")
-        
-        # Clean up the image file
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-            logger.info(f"Cleaned up temporary file: {temp_image_path}")
 
         # Delete the processing message
         await processing_msg.delete()
@@ -532,9 +703,6 @@ async def handle_image_message(update: Update, context):
 
     except Exception as e:
         logger.error(f"Failed to handle image message: {e}", exc_info=True)
-        # Clean up file if it exists
-        if 'temp_image_path' in locals() and os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
         await update.message.reply_text("Maaf, terjadi kesalahan saat memproses gambar Anda. Silakan coba lagi.")
 
 async def button_callback_handler(update: Update, context):
@@ -546,11 +714,13 @@ async def button_callback_handler(update: Update, context):
     if query.data == "confirm_add_receipt":
         pending_items = context.user_data.get('pending_items')
         if pending_items:
-            success = update_inventory("ADD", pending_items, user_name)
+            # Receipt names are shown to the user as read; lowercase them only for storage
+            pending_items = [{**item, "name": item["name"].lower()} for item in pending_items]
+            success = await asyncio.to_thread(update_inventory, "ADD", pending_items, user_name)
             if success:
                 # Tampilkan daftar stok lengkap setelah konfirmasi struk
                 reply_lines = ["Sip! Stok telah berhasil diperbarui dari struk."]
-                all_items = query_all_inventory()
+                all_items = await asyncio.to_thread(query_all_inventory)
                 if not all_items:
                     reply_lines.append("\nStok sekarang kosong.")
                 else:
@@ -574,7 +744,7 @@ async def button_callback_handler(update: Update, context):
     
     elif query.data == "get_recipes":
         user_name = query.from_user.first_name
-        all_items = query_all_inventory()
+        all_items = await asyncio.to_thread(query_all_inventory)
         
         if not all_items:
             await query.edit_message_text(text="Maaf, tidak ada bahan yang tersedia untuk membuat resep.")
@@ -583,7 +753,7 @@ async def button_callback_handler(update: Update, context):
         # Show loading message
         await query.edit_message_text(text="🍳 Sedang mencari resep yang cocok...")
         
-        recipe_data = get_recipe_suggestions(all_items)
+        recipe_data = await get_recipe_suggestions(all_items)
         
         if recipe_data and recipe_data.get("recipes"):
             recipes = recipe_data.get("recipes")
@@ -613,18 +783,14 @@ async def button_callback_handler(update: Update, context):
     elif query.data == "confirm_clear_all":
         user_name = query.from_user.first_name
         
-        # Get items count before clearing
-        all_items = query_all_inventory()
-        items_count = len(all_items)
-        
-        success = clear_all_inventory(user_name)
-        if success:
-            if items_count > 0:
-                reply_text = f"✅ *Berhasil!*\n\nSemua {items_count} item telah dihapus dari stok oleh {user_name}.\nStok sekarang kosong."
-            else:
-                reply_text = "Stok sudah kosong sebelumnya."
-        else:
+        # clear_all_inventory reports how many items it removed, so no extra count query is needed
+        items_count = await asyncio.to_thread(clear_all_inventory, user_name)
+        if items_count is None:
             reply_text = "❌ Maaf, terjadi kesalahan saat menghapus stok. Silakan coba lagi."
+        elif items_count > 0:
+            reply_text = f"✅ *Berhasil!*\n\nSemua {items_count} item telah dihapus dari stok oleh {user_name}.\nStok sekarang kosong."
+        else:
+            reply_text = "Stok sudah kosong sebelumnya."
         
         await query.edit_message_text(text=reply_text, parse_mode='Markdown')
     
@@ -636,7 +802,7 @@ async def handle_recipe_button(update: Update, context):
     chat_id = update.message.chat_id
     user_name = update.message.from_user.first_name
     
-    all_items = query_all_inventory()
+    all_items = await asyncio.to_thread(query_all_inventory)
     if not all_items:
         await update.message.reply_text("Maaf, stok Anda masih kosong. Tambahkan bahan-bahan terlebih dahulu untuk mendapatkan saran resep! 🍳")
         return
@@ -644,25 +810,40 @@ async def handle_recipe_button(update: Update, context):
     # Send thinking message
     thinking_msg = await update.message.reply_text("🍳 Sedang mencari resep yang cocok...")
     
-    recipe_data = get_recipe_suggestions(all_items)
+    recipe_data = await get_recipe_suggestions(all_items)
     
     # Delete thinking message
     await thinking_msg.delete()
     
     if recipe_data and recipe_data.get("recipes"):
         recipes = recipe_data.get("recipes")
-        reply_lines = [f"🍳 *Resep untuk {user_name}:*\n"]
-        
-        for i, recipe in enumerate(recipes[:3], 1):
-            reply_lines.append(f"*{i}. {recipe.get('name')}*")
-            reply_lines.append(f"⏱️ {recipe.get('cooking_time')} | 📊 {recipe.get('difficulty')}")
-            reply_lines.append(f"📝 {recipe.get('description')}")
-            reply_lines.append("")
-        
-        await update.message.reply_text("\n".join(reply_lines), parse_mode='Markdown')
+        reply_text = f"🍳 *Resep untuk {user_name}:*\n\n" + "\n\n".join(
+            f"*{i}. {recipe.get('name')}*\n"
+            f"⏱️ {recipe.get('cooking_time')} | 📊 {recipe.get('difficulty')}\n"
+            f"📝 {recipe.get('description')}"
+            for i, recipe in enumerate(recipes[:3], 1)
+        )
+        
+        await update.message.reply_text(reply_text, parse_mode='Markdown')
     else:
         await update.message.reply_text("Maaf, tidak ada resep yang cocok saat ini. Coba tambah lebih banyak bahan!")
 
+# Reply templates for stickers and unsupported messages, filled in with the user's name
+_STICKER_TEMPLATES = (
+    "Haha, stiker yang lucu {name}! 😄\nAda yang bisa saya bantu dengan stok belanja Anda?",
+    "Terima kasih stikernya {name}! 😊\nBtw, mau cek stok atau tambah belanja?",
+    "Saya suka stiker itu {name}! 🎉\nAda bahan makanan yang mau ditambah ke stok?",
+)
+_UNSUPPORTED_TEMPLATE = "\n".join((
+    "Maaf {name}, saya tidak bisa memproses {message_type}.\n",
+    "Saya bisa membantu dengan:",
+    "📝 *Teks* - untuk menambah/gunakan/cek stok",
+    "🎤 *Voice note* - bicara tentang belanja",
+    "📸 *Foto struk* - scan otomatis",
+    "🍳 *Resep* - ketik 'resep' untuk saran masakan",
+    "🗑️ *Hapus semua* - ketik 'hapus semua' untuk kosongkan stok",
+))
+
 async def handle_sticker_message(update: Update, context):
     """Handle sticker messages with a friendly response."""
     user_name = update.message.from_user.first_name
@@ -670,13 +851,7 @@ async def handle_sticker_message(update: Update, context):
     
     logger.info(f"Received sticker from {user_name} in chat {chat_id}")
     
-    responses = [
-        f"Haha, stiker yang lucu {user_name}! 😄\nAda yang bisa saya bantu dengan stok belanja Anda?",
-        f"Terima kasih stikernya {user_name}! 😊\nBtw, mau cek stok atau tambah belanja?",
-        f"Saya suka stiker itu {user_name}! 🎉\nAda bahan makanan yang mau ditambah ke stok?"
-    ]
-    
-    reply_text = random.choice(responses)
+    reply_text = random.choice(_STICKER_TEMPLATES).format(name=user_name)
     await ptb_app.bot.send_message(chat_id=chat_id, text=reply_text)
 
 async def handle_unsupported_message(update: Update, context):
@@ -702,24 +877,106 @@ async def handle_unsupported_message(update: Update, context):
     
     logger.info(f"Received {message_type} from {user_name} in chat {chat_id}")
     
-    reply_text = f"Maaf {user_name}, saya tidak bisa memproses {message_type}.\n\n"
-    reply_text += "Saya bisa membantu dengan:\n"
-    reply_text += "📝 *Teks* - untuk menambah/gunakan/cek stok\n"
-    reply_text += "🎤 *Voice note* - bicara tentang belanja\n"
-    reply_text += "📸 *Foto struk* - scan otomatis\n"
-    reply_text += "🍳 *Resep* - ketik 'resep' untuk saran masakan\n"
-    reply_text += "🗑️ *Hapus semua* - ketik 'hapus semua' untuk kosongkan stok"
+    reply_text = _UNSUPPORTED_TEMPLATE.format(name=user_name, message_type=message_type)
     
     await ptb_app.bot.send_message(chat_id=chat_id, text=reply_text, parse_mode='Markdown')
 
 # --- FastAPI Webhook Endpoint ---
+# Updates are processed in the background so Telegram gets its 200 right away instead of
+# timing out and redelivering while Gemini is busy. The semaphore bounds the work in flight.
+MAX_CONCURRENT_UPDATES = 16
+update_semaphore = asyncio.Semaphore(MAX_CONCURRENT_UPDATES)
+# Threads behind asyncio.to_thread (SQLite, audio conversion, image resizing), installed in lifespan.
+# A fixed size keeps the thread count predictable on any host, and tying it to MAX_CONCURRENT_UPDATES
+# lets every update in flight have one blocking call running.
+IO_THREAD_POOL_SIZE = MAX_CONCURRENT_UPDATES
+background_tasks = set()  # Keeps references so running tasks aren't garbage collected
+
+SHUTDOWN_DRAIN_TIMEOUT = 30  # Seconds to let in-flight updates finish on shutdown
+
+# Each chat gets its own queue and worker: updates within a chat stay in order, while a slow
+# update (recipe generation, transcription) in one chat doesn't hold up the others.
+CHAT_IDLE_TIMEOUT = 300  # Seconds before an idle chat worker exits
+chat_queues: dict[int, asyncio.Queue] = {}
+chat_workers: dict[int, asyncio.Task] = {}
+
+async def process_update_in_background(update: Update):
+    async with update_semaphore:
+        await ptb_app.process_update(update)
+
+def _on_update_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    # Retrieve the exception here so it is logged instead of "Task exception was never retrieved"
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Error processing update in background", exc_info=task.exception())
+
+async def _chat_worker(chat_id: int):
+    """Processes one chat's updates in order, exiting once the chat has been idle for a while."""
+    queue = chat_queues[chat_id]
+    try:
+        while True:
+            try:
+                update = await asyncio.wait_for(queue.get(), CHAT_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    return
+                continue
+            try:
+                await process_update_in_background(update)
+            except Exception as e:
+                logger.error(f"Error processing update for chat {chat_id}: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+    finally:
+        chat_queues.pop(chat_id, None)
+        chat_workers.pop(chat_id, None)
+
+def dispatch_update(update: Update):
+    """Queues the update on its chat's worker, or processes it on its own if it has no chat."""
+    chat = update.effective_chat
+    if chat is None:
+        task = asyncio.create_task(process_update_in_background(update))
+        background_tasks.add(task)
+        task.add_done_callback(_on_update_done)
+        return
+
+    queue = chat_queues.get(chat.id)
+    if queue is None:
+        queue = chat_queues[chat.id] = asyncio.Queue()
+        chat_workers[chat.id] = asyncio.create_task(_chat_worker(chat.id))
+    queue.put_nowait(update)
+
+async def drain_pending_updates():
+    """Waits up to SHUTDOWN_DRAIN_TIMEOUT for queued and in-flight updates, then stops the chat workers."""
+    pending = [asyncio.create_task(queue.join()) for queue in chat_queues.values()] + list(background_tasks)
+    still_running = set()
+    if pending:
+        logger.info(f"Waiting for pending updates in {len(chat_queues)} chats and {len(background_tasks)} other tasks...")
+        _, still_running = await asyncio.wait(pending, timeout=SHUTDOWN_DRAIN_TIMEOUT)
+        for task in still_running:
+            task.cancel()
+    workers = list(chat_workers.values())
+    for worker in workers:
+        worker.cancel()
+    # Let cancelled tasks unwind before the PTB application is shut down underneath them
+    await asyncio.gather(*workers, *still_running, return_exceptions=True)
+
 @app.post("/webhook")
 async def telegram_webhook(request: Request):
     try:
-        update_json = await request.json()
-        logger.info(f"Webhook received update: {update_json}")
+        update_json = orjson.loads(await request.body())
+        if logger.isEnabledFor(logging.DEBUG):
+            # The full payload can be large (photo sizes, entities), so it is only formatted at DEBUG
+            logger.debug(f"Webhook received update: {update_json}")
+
+        # No handler takes other update types, so skip building the Update object for them
+        if update_json.keys().isdisjoint(WEBHOOK_ALLOWED_UPDATES):
+            logger.info(f"Ignoring update {update_json.get('update_id')} with no message or callback query")
+            return {"status": "ok"}
         
         update = Update.de_json(update_json, ptb_app.bot)
+        chat_id = update.effective_chat.id if update.effective_chat else None
+        logger.info(f"Webhook received update {update.update_id} for chat {chat_id}")
         
         # Log what type of update this is
         if update.message:
@@ -736,7 +993,7 @@ async def telegram_webhook(request: Request):
         else:
             logger.info(f"Processing other update type: {type(update)}")
         
-        await ptb_app.process_update(update)
+        dispatch_update(update)
         return {"status": "ok"}
     except Exception as e:
         logger.error(f"Error processing webhook: {e}", exc_info=True)
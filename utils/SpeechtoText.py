@@ -1,16 +1,26 @@
-import os
-import wave
+import io
+import asyncio
+import hashlib
 from pathlib import Path
 from pydub import AudioSegment
 from google.cloud import speech
 from google.oauth2 import service_account
 
+from utils.cache import LRUCache
+
+# Voice notes are resampled to this rate, the API's recommended rate for speech
+SAMPLE_RATE_HZ = 16000
+
+# Number of transcriptions kept in memory, keyed by a hash of the original audio bytes
+TRANSCRIPTION_CACHE_SIZE = 256
+
 class SpeechToText:
     """
     A class to handle audio transcription using Google Cloud Speech-to-Text API.
     
     This class manages authentication, audio file conversion to WAV format,
     and sending requests to the Google Cloud API to get transcriptions.
+    Requests go through the async client, so several voice notes can be transcribed at once.
     """
 
     def __init__(self, service_account_path: str):
@@ -21,73 +31,84 @@ class SpeechToText:
             service_account_path (str): The file path to the Google Cloud service account JSON key.
         """
         try:
-            credentials = service_account.Credentials.from_service_account_file(service_account_path)
-            self.client = speech.SpeechClient(credentials=credentials)
+            self.credentials = service_account.Credentials.from_service_account_file(service_account_path)
+            # The async client binds to the running event loop, so it is created on first use
+            self.client = None
+            # Forwarded or re-sent voice notes are byte-identical, so their transcription is reused
+            self._transcription_cache = LRUCache(TRANSCRIPTION_CACHE_SIZE)
             print("SpeechToText client initialized successfully.")
         except Exception as e:
             print(f"Error initializing client with service account from {service_account_path}: {e}")
             raise
 
-    def _convert_to_wav(self, input_path: Path) -> (Path, int):
+    def _convert_to_wav(self, audio_source) -> (bytes, int):
         """
-        Converts an audio file to a mono, 16-bit WAV file, which is optimal for the API.
+        Converts audio to a mono, 16-bit, 16 kHz WAV, which is optimal for the API.
+        Decoding the input still goes through ffmpeg, but the WAV is written by pydub straight
+        into memory, without a second ffmpeg run or temporary files.
 
         Args:
-            input_path (Path): The path to the input audio file (e.g., .m4a, .mp3).
+            audio_source (Path | bytes): The path to the input audio file (e.g., .m4a, .mp3) or its raw bytes.
 
         Returns:
             A tuple containing:
-            - wav_path (Path): The path to the converted WAV file.
-            - sample_rate (int): The sample rate of the converted WAV file.
+            - content (bytes): The converted WAV data.
+            - sample_rate (int): The sample rate of the converted WAV data (always SAMPLE_RATE_HZ).
         """
-        wav_path = input_path.with_suffix('.wav')
-        print(f"Input file: {input_path}")
+        if isinstance(audio_source, Path):
+            print(f"Input file: {audio_source}")
+        else:
+            print(f"Input audio: {len(audio_source)} bytes in memory")
+            audio_source = io.BytesIO(audio_source)
         
         try:
             print("Loading audio file with pydub...")
-            audio = AudioSegment.from_file(input_path)
-            
-            print(f"Exporting to WAV format: {wav_path}")
-            # Export as WAV, ensuring mono channel and 16-bit PCM codec
-            audio.export(wav_path, format="wav", parameters=["-ac", "1", "-acodec", "pcm_s16le"])
-
-            # Get sample rate from the newly created file
-            with wave.open(str(wav_path), "rb") as wav_file:
-                sample_rate = wav_file.getframerate()
+            audio = AudioSegment.from_file(audio_source)
             
-            print(f"Detected sample rate of converted WAV: {sample_rate} Hz")
-            return wav_path, sample_rate
+            print("Exporting to WAV format in memory")
+            # Resample to mono, a fixed sample rate and 16-bit PCM in pydub itself. Pinning the rate
+            # means it is known up front, and exporting plain WAV without ffmpeg parameters lets
+            # pydub write the file directly into the buffer.
+            audio = audio.set_channels(1).set_frame_rate(SAMPLE_RATE_HZ).set_sample_width(2)
+            wav_buffer = io.BytesIO()
+            audio.export(wav_buffer, format="wav")
+            return wav_buffer.getvalue(), SAMPLE_RATE_HZ
 
         except Exception as e:
             print(f"Error during audio conversion: {e}")
             raise
 
-    def transcribe_audio(self, input_file_path: str, language_code: str = "id-ID", cleanup_wav: bool = True) -> list:
+    async def transcribe_audio(self, audio_source, language_code: str = "id-ID") -> list:
         """
         Transcribes a given audio file.
+        The CPU-bound conversion runs in a worker thread and the API call is awaited.
+        Results for audio passed as bytes are cached, so identical audio is only sent once.
 
         Args:
-            input_file_path (str): The path to the audio file to transcribe.
+            audio_source (str | bytes): The path to the audio file to transcribe, or the audio's raw bytes.
             language_code (str, optional): The language code for transcription (e.g., "en-US"). Defaults to "id-ID".
-            cleanup_wav (bool, optional): If True, deletes the temporary WAV file after transcription. Defaults to True.
 
         Returns:
             list: A list of transcription results from the API. Returns an empty list on failure.
         """
-        input_path = Path(input_file_path)
-        if not input_path.exists():
-            print(f"Error: Input file not found at {input_file_path}")
-            return []
+        cache_key = None
+        if isinstance(audio_source, (bytes, bytearray)):
+            audio_source = bytes(audio_source)
+            cache_key = (hashlib.blake2b(audio_source, digest_size=16).digest(), language_code)
+            cached = self._transcription_cache.get(cache_key)
+            if cached is not None:
+                print("Using cached transcription for identical audio.")
+                return cached
+        else:
+            audio_source = Path(audio_source)
+            if not audio_source.exists():
+                print(f"Error: Input file not found at {audio_source}")
+                return []
 
-        wav_path = None
         try:
             # Convert audio and get its properties
-            wav_path, sample_rate = self._convert_to_wav(input_path)
+            content, sample_rate = await asyncio.to_thread(self._convert_to_wav, audio_source)
 
-            # Read audio content for the API
-            with open(wav_path, "rb") as audio_file:
-                content = audio_file.read()
-            
             recognition_audio = speech.RecognitionAudio(content=content)
 
             # Configure and send the recognition request
@@ -98,16 +119,16 @@ class SpeechToText:
                 alternative_language_codes=["en-US"], # Example of alternative
             )
 
+            if self.client is None:
+                self.client = speech.SpeechAsyncClient(credentials=self.credentials)
+
             print("Sending request to Speech-to-Text API...")
-            response = self.client.recognize(config=config, audio=recognition_audio)
-            
+            response = await self.client.recognize(config=config, audio=recognition_audio)
+
+            if cache_key is not None and response.results:
+                self._transcription_cache.put(cache_key, response.results)
             return response.results
 
         except Exception as e:
             print(f"An error occurred during transcription: {e}")
             return []
-        finally:
-            # Clean up the temporary WAV file
-            if cleanup_wav and wav_path and wav_path.exists():
-                os.remove(wav_path)
-                print(f"Cleaned up temporary file: {wav_path}")
\ No newline at end of file
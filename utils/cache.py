@@ -0,0 +1,43 @@
+# utils/cache.py
+# Small in-process caches used to skip repeated Gemini calls and database reads.
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded least-recently-used cache.
+
+    Unlike functools.lru_cache this works for async functions and lets the caller
+    choose the key (e.g. whitespace-normalized text instead of the raw argument).
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the cached value for key (marking it as recently used), or default."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        """Stores value under key, evicting the least recently used entry if full."""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
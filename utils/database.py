@@ -3,243 +3,289 @@
 
 import sqlite3
 import logging
-from datetime import datetime
+import threading
+import time
+
+from rapidfuzz import fuzz, process
+
+from database_setup import DB_PATH, get_pool, init_schema
+from utils.cache import LRUCache
 
 # --- Konfigurasi ---
-DATABASE_PATH = "/app/data/groceries.db"  # Path di dalam kontainer Docker
+DATABASE_PATH = DB_PATH  # Path di dalam kontainer Docker (override dengan GROCERIES_DB_PATH)
 logger = logging.getLogger(__name__)
 
-# We'll import the normalization function when needed to avoid circular imports
+# Snapshot version of the inventory, bumped after every committed write.
+# Cached reads are tagged with the version they were taken at and reused until it changes.
+_snapshot_version = 0
+_all_inventory_cache = None  # (snapshot_version, rows)
+_cache_lock = threading.Lock()
+
+# Per-name stock replies, keyed by snapshot_version so a write makes every older entry unreachable
+_query_inventory_cache = LRUCache(2048)  # (item_name, version) -> reply text
+
+# Minimum rapidfuzz WRatio (0-100) for query_inventory to suggest a stocked item
+SIMILAR_ITEM_SCORE_CUTOFF = 80
+
+def _bump_snapshot_version():
+    """Invalidates every cached inventory read. Call after committing a write."""
+    global _snapshot_version
+    with _cache_lock:
+        _snapshot_version += 1
+
+def _current_snapshot_version() -> int:
+    """Returns the version to tag a read with. Take it *before* reading so a concurrent write isn't missed."""
+    with _cache_lock:
+        return _snapshot_version
+
+# The schema (tables + indexes) is ensured once per process, the first time the pool is used,
+# so the bot also works when started without running database_setup.py first.
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def _ensure_schema(pool):
+    """Membuat tabel dan indeks yang belum ada, sekali per proses."""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with pool.connection() as conn:
+            _schema_ready = init_schema(conn)
 
 def create_connection():
-    """Membuat koneksi ke database SQLite."""
-    conn = None
-    try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Error saat menyambungkan ke database: {e}")
-    return conn
+    """
+    Meminjam koneksi dari pool bersama, dipakai sebagai `with create_connection() as conn:`.
+    The pooled connections are opened once per process with WAL and the other PRAGMAs applied,
+    and any uncommitted transaction is rolled back when the block exits.
+    Raises sqlite3.Error if the database cannot be opened.
+    """
+    pool = get_pool(DATABASE_PATH)
+    if not _schema_ready:
+        _ensure_schema(pool)
+    return pool.connection()
 
 def update_inventory(action: str, items: list, user_name: str):
     """
     Fungsi utama untuk memperbarui inventaris berdasarkan aksi (ADD/USE).
     Now with smart ingredient matching!
+    ADD is a single executemany UPSERT and USE a single UPDATE per item, so no item is read
+    before it is written.
     """
-    conn = create_connection()
-    if not conn:
-        return False
+    action = action.upper()
+
+    # Gabungkan item dengan nama yang sama; applying the summed quantity once gives the same
+    # result as applying them one after another (including the USE clamp at zero)
+    changes = {}
+    for item in items:
+        # Item name should already be processed (and lowercased) by main.py
+        item_name = item["name"]
+        quantity = float(item.get("quantity", 0))
+        if item_name in changes:
+            changes[item_name][0] += quantity
+        else:
+            changes[item_name] = [quantity, item.get("unit", "")]
+
+    if not changes or action not in ("ADD", "USE"):
+        return True
 
+    now = int(time.time())
     try:
-        cursor = conn.cursor()
-        for item in items:
-            # Item name should already be processed by main.py
-            item_name = item.get("name").lower()
-            quantity = float(item.get("quantity", 0))
-            unit = item.get("unit", "")
-
-            logger.info(f"Processing item: '{item_name}'")
-
-            # Periksa apakah item sudah ada
-            cursor.execute("SELECT quantity FROM inventory WHERE item_name = ?", (item_name,))
-            data = cursor.fetchone()
-
-            if action.upper() == "ADD":
-                if data is None:
-                    # Item baru, lakukan INSERT
-                    cursor.execute(
-                        "INSERT INTO inventory (item_name, quantity, unit, last_updated, last_updated_by) VALUES (?, ?, ?, ?, ?)",
-                        (item_name, quantity, unit, datetime.now(), user_name)
-                    )
-                    logger.info(f"INSERTED: {quantity} {unit} of {item_name} by {user_name}")
-                else:
-                    # Item sudah ada, lakukan UPDATE
-                    new_quantity = data[0] + quantity
-                    cursor.execute(
-                        "UPDATE inventory SET quantity = ?, last_updated = ?, last_updated_by = ? WHERE item_name = ?",
-                        (new_quantity, datetime.now(), user_name, item_name)
-                    )
-                    logger.info(f"UPDATED: Added {quantity} to {item_name}. New total: {new_quantity}. By {user_name}")
-                
-                # Catat transaksi penambahan
-                log_transaction(cursor, item_name, quantity, user_name)
-
-            elif action.upper() == "USE":
-                if data is None:
-                    # Tidak bisa menggunakan item yang tidak ada
-                    logger.warning(f"Attempted to USE non-existent item: {item_name} by {user_name}")
-                    continue # Lanjut ke item berikutnya
-                else:
-                    # Kurangi kuantitas
-                    new_quantity = max(0, data[0] - quantity) # Pastikan tidak negatif
-                    cursor.execute(
-                        "UPDATE inventory SET quantity = ?, last_updated = ?, last_updated_by = ? WHERE item_name = ?",
-                        (new_quantity, datetime.now(), user_name, item_name)
-                    )
-                    logger.info(f"UPDATED: Used {quantity} of {item_name}. New total: {new_quantity}. By {user_name}")
-                
-                # Catat transaksi penggunaan
-                log_transaction(cursor, item_name, -quantity, user_name)
-
-        conn.commit()
+        with create_connection() as conn:
+            # Take the write lock up front: one transaction, one commit, and no mid-way
+            # read-to-write upgrade that a concurrent writer could make fail with SQLITE_BUSY
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+            log_rows = []
+
+            if action == "ADD":
+                # Item baru di-INSERT, item yang sudah ada ditambah; one UPSERT covers both without a prior SELECT
+                cursor.executemany(
+                    "INSERT INTO inventory (item_name, quantity, unit, last_updated, last_updated_by) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(item_name) DO UPDATE SET quantity = quantity + excluded.quantity, "
+                    "last_updated = excluded.last_updated, last_updated_by = excluded.last_updated_by",
+                    [(item_name, quantity, unit, now, user_name) for item_name, (quantity, unit) in changes.items()]
+                )
+                for item_name, (quantity, unit) in changes.items():
+                    logger.info(f"UPSERTED: Added {quantity} {unit} of {item_name} by {user_name}")
+                    # Catat transaksi penambahan
+                    log_rows.append((item_name, quantity, user_name, now))
+
+            else:  # USE
+                for item_name, (quantity, unit) in changes.items():
+                    # Kurangi kuantitas, pastikan tidak negatif. No row back means the item doesn't exist.
+                    row = cursor.execute(
+                        "UPDATE inventory SET quantity = max(0, quantity - ?), last_updated = ?, last_updated_by = ? "
+                        "WHERE item_name = ? RETURNING quantity",
+                        (quantity, now, user_name, item_name)
+                    ).fetchone()
+                    if row is None:
+                        # Tidak bisa menggunakan item yang tidak ada
+                        logger.warning(f"Attempted to USE non-existent item: {item_name} by {user_name}")
+                        continue # Lanjut ke item berikutnya
+                    logger.info(f"UPDATED: Used {quantity} of {item_name}. New total: {row['quantity']}. By {user_name}")
+
+                    # Catat transaksi penggunaan
+                    log_rows.append((item_name, -quantity, user_name, now))
+
+            log_transactions(cursor, log_rows)
+
+            conn.commit()
+        _bump_snapshot_version()
         return True
     except sqlite3.Error as e:
+        # The pool rolls back the unfinished transaction before reusing the connection
         logger.error(f"Database transaction failed: {e}")
-        conn.rollback()
         return False
-    finally:
-        if conn:
-            conn.close()
 
-def log_transaction(cursor, item_name, quantity_change, user_name):
-    """Mencatat setiap transaksi ke tabel transaction_log."""
-    cursor.execute(
+def log_transactions(cursor, rows):
+    """
+    Mencatat banyak transaksi sekaligus dengan satu executemany.
+    Each row is (item_name, quantity_change, user_name, transaction_time).
+    """
+    if not rows:
+        return
+    cursor.executemany(
         "INSERT INTO transaction_log (item_name, quantity_change, user_name, transaction_time) VALUES (?, ?, ?, ?)",
-        (item_name, quantity_change, user_name, datetime.now())
+        rows
     )
-    logger.info(f"LOGGED: {user_name} changed {item_name} by {quantity_change}")
+    for item_name, quantity_change, user_name, _ in rows:
+        logger.info(f"LOGGED: {user_name} changed {item_name} by {quantity_change}")
 
 def query_inventory(item_name: str) -> str:
     """
     Memeriksa stok item tertentu di database.
     Now with smart ingredient matching!
+    Replies are cached per item name until the next write.
     """
-    conn = create_connection()
-    if not conn:
-        return "Maaf, saya tidak bisa terhubung ke database saat ini."
-    
+    key = (item_name, _current_snapshot_version())
+    reply = _query_inventory_cache.get(key)
+    if reply is not None:
+        return reply
+
     try:
+        reply = _lookup_inventory(item_name)
+    except sqlite3.Error as e:
+        logger.error(f"Database query failed: {e}")
+        return "Terjadi kesalahan saat memeriksa stok."
+    _query_inventory_cache.put(key, reply)
+    return reply
+
+def _lookup_inventory(item_name: str) -> str:
+    """Builds the stock reply for query_inventory. Raises sqlite3.Error on failure."""
+    with create_connection() as conn:
         cursor = conn.cursor()
-        
+
         # First try exact match
         cursor.execute("SELECT quantity, unit FROM inventory WHERE item_name = ?", (item_name.lower(),))
         data = cursor.fetchone()
-        
+
         if data:
-            return f"Stok untuk '{item_name}' saat ini adalah {data[0]} {data[1]}."
-        
-        # If not found, try to find similar items
-        cursor.execute("SELECT item_name, quantity, unit FROM inventory WHERE quantity > 0")
-        all_items = cursor.fetchall()
-        
-        # Simple fuzzy matching
+            return f"Stok untuk '{item_name}' saat ini adalah {data['quantity']} {data['unit']}."
+
+        # If not found, try to find similar items.
+        # Simple fuzzy matching (either name contains the other), done in SQL so only the
+        # match is returned; instr() keeps '%' and '_' in the user's text from acting as wildcards
         item_lower = item_name.lower()
-        for db_name, quantity, unit in all_items:
-            if item_lower in db_name or db_name in item_lower:
-                return f"Mungkin maksud Anda '{db_name}' yang tersedia {quantity} {unit}?"
-        
-        return f"Maaf, saya tidak dapat menemukan item '{item_name}' di dalam stok."
-    except sqlite3.Error as e:
-        logger.error(f"Database query failed: {e}")
-        return "Terjadi kesalahan saat memeriksa stok."
-    finally:
-        if conn:
-            conn.close()
+        cursor.execute(
+            "SELECT item_name, quantity, unit FROM inventory "
+            "WHERE quantity > 0 AND (instr(item_name, ?) > 0 OR instr(?, item_name) > 0) "
+            "ORDER BY item_name LIMIT 1",
+            (item_lower, item_lower)
+        )
+        similar = cursor.fetchone()
 
+    if not similar:
+        # Typo-tolerant fallback ("tlur" -> "telur") over the cached list of stocked items
+        stocked = query_all_inventory()
+        match = process.extractOne(item_lower, [row["item_name"] for row in stocked],
+                                   scorer=fuzz.WRatio, score_cutoff=SIMILAR_ITEM_SCORE_CUTOFF)
+        if match:
+            similar = stocked[match[2]]
+
+    if similar:
+        db_name, quantity, unit = similar
+        return f"Mungkin maksud Anda '{db_name}' yang tersedia {quantity} {unit}?"
+
+    return f"Maaf, saya tidak dapat menemukan item '{item_name}' di dalam stok."
 
 def query_all_inventory() -> list:
     """
     FUNGSI BARU: Mengambil semua item dari tabel inventaris.
+    The result is cached until the next write, so repeated calls within one update are free.
     """
-    conn = create_connection()
-    if not conn:
-        return []
-    
+    global _all_inventory_cache
+    with _cache_lock:
+        version = _snapshot_version
+        cached = _all_inventory_cache
+    if cached is not None and cached[0] == version:
+        return list(cached[1])
+
     try:
-        cursor = conn.cursor()
-        # Mengambil semua data dan mengurutkannya berdasarkan nama item
-        cursor.execute("SELECT item_name, quantity, unit FROM inventory WHERE quantity > 0 ORDER BY item_name ASC")
-        all_items = cursor.fetchall()
-        return all_items
+        with create_connection() as conn:
+            # Mengambil semua data dan mengurutkannya berdasarkan nama item
+            all_items = conn.execute("SELECT item_name, quantity, unit FROM inventory WHERE quantity > 0 ORDER BY item_name ASC").fetchall()
+        with _cache_lock:
+            _all_inventory_cache = (version, all_items)
+        return list(all_items)
     except sqlite3.Error as e:
         logger.error(f"Database query all failed: {e}")
         return []
-    finally:
-        if conn:
-            conn.close()
 
-def find_similar_item(item_name: str, normalize_func=None) -> str:
-    """Find if there's a similar item already in the database."""
-    try:
-        conn = create_connection()
-        if not conn:
-            return item_name.lower()
-        
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT item_name FROM inventory WHERE quantity > 0")
-        existing_items = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        if not existing_items:
-            return item_name.lower()
-        
-        # If we have a normalization function, use it
-        if normalize_func:
-            # Normalize the new item
-            normalized_new = normalize_func(item_name)
-            
-            # Check if the normalized name already exists
-            for existing in existing_items:
-                normalized_existing = normalize_func(existing)
-                if normalized_new == normalized_existing:
-                    logger.info(f"Found match: '{item_name}' matches existing '{existing}'")
-                    return existing  # Return the existing name to maintain consistency
-            
-            # If no match found, return the normalized name
-            return normalized_new
-        else:
-            # Fallback: basic matching
-            item_lower = item_name.lower()
-            for existing in existing_items:
-                if item_lower == existing.lower():
-                    return existing
-            return item_lower
-        
-    except Exception as e:
-        logger.error(f"Error finding similar item for '{item_name}': {e}")
-        return item_name.lower()
-
-def clear_all_inventory(user_name: str) -> bool:
+def clear_all_inventory(user_name: str):
     """
     Clear all items from the inventory and log the action.
-    Returns True if successful, False otherwise.
+    Returns the number of items cleared if successful, None otherwise.
     """
-    conn = create_connection()
-    if not conn:
-        return False
-
     try:
-        cursor = conn.cursor()
-        
-        # Get all items before clearing for logging
-        cursor.execute("SELECT item_name, quantity, unit FROM inventory WHERE quantity > 0")
-        items_to_clear = cursor.fetchall()
-        
-        if not items_to_clear:
-            logger.info(f"No items to clear for {user_name}")
-            return True  # Nothing to clear is still a success
-        
-        # Log each item being cleared
-        for item_name, quantity, unit in items_to_clear:
-            log_transaction(cursor, item_name, -quantity, user_name)
-            logger.info(f"Clearing: {quantity} {unit} of {item_name} by {user_name}")
-        
-        # Clear all inventory by setting quantity to 0
-        cursor.execute("UPDATE inventory SET quantity = 0, last_updated = ?, last_updated_by = ?", 
-                      (datetime.now(), user_name))
-        
-        # Also delete items with 0 quantity to keep database clean
-        cursor.execute("DELETE FROM inventory WHERE quantity = 0")
-        
-        conn.commit()
+        with create_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.cursor()
+
+            # Delete every row in one statement; RETURNING hands back what was removed for the log.
+            # Rows already at 0 are dropped too (keeps the database clean) but not logged.
+            removed = cursor.execute("DELETE FROM inventory RETURNING item_name, quantity, unit").fetchall()
+            items_to_clear = [row for row in removed if row["quantity"] > 0]
+
+            if not removed:
+                logger.info(f"No items to clear for {user_name}")
+                return 0  # Nothing to clear is still a success
+
+            for item_name, quantity, unit in items_to_clear:
+                logger.info(f"Clearing: {quantity} {unit} of {item_name} by {user_name}")
+            now = int(time.time())
+            log_transactions(cursor, [(item_name, -quantity, user_name, now) for item_name, quantity, unit in items_to_clear])
+
+            conn.commit()
+        _bump_snapshot_version()
         logger.info(f"Successfully cleared {len(items_to_clear)} items from inventory by {user_name}")
-        return True
-        
+        return len(items_to_clear)
+
     except sqlite3.Error as e:
         logger.error(f"Database error while clearing inventory: {e}")
-        conn.rollback()
-        return False
-    finally:
-        if conn:
-            conn.close()
+        return None
 
+def load_ingredient_aliases() -> dict:
+    """
+    Mengambil semua normalisasi nama bahan yang sudah dipelajari.
+    Returns a dict of alias -> normalized name, or an empty dict on failure.
+    """
+    try:
+        with create_connection() as conn:
+            return dict(conn.execute("SELECT alias, normalized_name FROM ingredient_alias").fetchall())
+    except sqlite3.Error as e:
+        logger.error(f"Database error while loading ingredient aliases: {e}")
+        return {}
+
+def save_ingredient_alias(alias: str, normalized_name: str) -> bool:
+    """Menyimpan normalisasi nama bahan agar tidak perlu ditanyakan lagi ke Gemini."""
+    try:
+        with create_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ingredient_alias (alias, normalized_name) VALUES (?, ?)",
+                (alias, normalized_name)
+            )
+            conn.commit()
+        return True
+    except sqlite3.Error as e:
+        logger.error(f"Database error while saving ingredient alias '{alias}': {e}")
+        return False